@@ -5,31 +5,136 @@ Provides one tool: weather lookup.
 """
 
 import os
-import requests
+import time
+import random
+import asyncio
+import aiohttp
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from typing import Any, Literal
 from fastmcp import FastMCP, Context
 from pydantic import BaseModel, Field
-
-# Create FastMCP server instance
-mcp = FastMCP("Simple MCP Server-US Weather Service")
+# orjson parses the larger forecast payloads much faster; fall back to the stdlib when missing
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 # Constants - National Weather Service API (US only)
 NWS_API_BASE = "https://api.weather.gov"
 USER_AGENT = "weather-app/1.0"
+NWS_HEADERS = {
+    "User-Agent": USER_AGENT,
+    "Accept": "application/geo+json"
+}
+# Fail fast when api.weather.gov is unreachable; each attempt gets at most 5 s
+NWS_TIMEOUT = aiohttp.ClientTimeout(total=5, connect=3.05)
+# Hard limit for one make_nws_request call, covering every retry and backoff
+NWS_DEADLINE = 10  # seconds
+# NWS regularly answers with transient 5xx errors, retry those with jittered backoff
+NWS_RETRIES = 2
+NWS_RETRY_STATUSES = frozenset({500, 502, 503, 504})
+NWS_BACKOFF = 0.3  # seconds, doubled on every retry
 
 ## Helper functions
-def make_nws_request(url: str) -> dict[str, Any] | None:
+_NWS_SESSION: aiohttp.ClientSession | None = None
+_NWS_SESSION_LOCK = asyncio.Lock()
+_active_lifespans = 0
+
+async def get_async_session() -> aiohttp.ClientSession:
+    """Return the shared aiohttp session, creating it on first use."""
+    global _NWS_SESSION
+    async with _NWS_SESSION_LOCK:
+        if _NWS_SESSION is None or _NWS_SESSION.closed:
+            connector = aiohttp.TCPConnector(limit=100, limit_per_host=8)
+            _NWS_SESSION = aiohttp.ClientSession(connector=connector, headers=NWS_HEADERS, timeout=NWS_TIMEOUT)
+        return _NWS_SESSION
+
+async def close_async_session() -> None:
+    """Close the shared aiohttp session and its pooled connections."""
+    global _NWS_SESSION
+    async with _NWS_SESSION_LOCK:
+        if _NWS_SESSION is not None and not _NWS_SESSION.closed:
+            await _NWS_SESSION.close()
+        _NWS_SESSION = None
+
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    """Close the shared HTTP session when the server shuts down."""
+    # The lifespan can be entered once per client session, so only the last one out closes
+    global _active_lifespans
+    _active_lifespans += 1
+    try:
+        yield
+    finally:
+        _active_lifespans -= 1
+        if _active_lifespans == 0:
+            await close_async_session()
+
+# Create FastMCP server instance
+mcp = FastMCP("Simple MCP Server-US Weather Service", lifespan=lifespan)
+
+async def make_nws_request(url: str, session: aiohttp.ClientSession | None = None) -> dict[str, Any] | None:
     """Make a request to the NWS API with proper error handling."""
-    headers = {
-        "User-Agent": USER_AGENT,
-        "Accept": "application/geo+json"
-    }
-    response = requests.get(url, headers=headers, timeout=10)
-    if response.status_code == 200:
-        return response.json()
-    else:
+    session = session or await get_async_session()
+    try:
+        return await asyncio.wait_for(_get_with_retries(session, url), NWS_DEADLINE)
+    except asyncio.TimeoutError:
         return None
 
+async def _get_with_retries(session: aiohttp.ClientSession, url: str) -> dict[str, Any] | None:
+    """GET a NWS URL, retrying transient failures with jittered backoff."""
+    for attempt in range(NWS_RETRIES + 1):
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return json_loads(await response.read())
+                if response.status not in NWS_RETRY_STATUSES or attempt == NWS_RETRIES:
+                    return None
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if attempt == NWS_RETRIES:
+                return None
+        await asyncio.sleep(NWS_BACKOFF * 2 ** attempt + random.uniform(0, NWS_BACKOFF))
+    return None
+
+# Gridpoint metadata for a coordinate rarely changes, so keep recent lookups in memory
+POINTS_CACHE_SIZE = 4096
+POINTS_CACHE_TTL = 86400  # seconds
+_POINTS_CACHE: OrderedDict[tuple[float, float], tuple[float, dict[str, Any]]] = OrderedDict()
+# Lookups currently in flight, so concurrent callers for one location share a single request
+_POINTS_INFLIGHT: dict[tuple[float, float], asyncio.Task] = {}
+
+async def _fetch_points_data(key: tuple[float, float]) -> dict[str, Any] | None:
+    """Fetch gridpoint metadata from NWS and store it in the cache."""
+    points_data = await make_nws_request(f"{NWS_API_BASE}/points/{key[0]},{key[1]}")
+    if points_data:
+        _POINTS_CACHE[key] = (time.monotonic(), points_data)
+        _POINTS_CACHE.move_to_end(key)
+        if len(_POINTS_CACHE) > POINTS_CACHE_SIZE:
+            _POINTS_CACHE.popitem(last=False)
+    return points_data
+
+async def get_points_data(latitude: float, longitude: float) -> dict[str, Any] | None:
+    """Get NWS gridpoint metadata for a location, served from an LRU cache when fresh."""
+    # NWS only resolves coordinates to 4 decimal places
+    key = (round(latitude, 4), round(longitude, 4))
+    cached = _POINTS_CACHE.get(key)
+    if cached is not None and time.monotonic() - cached[0] < POINTS_CACHE_TTL:
+        _POINTS_CACHE.move_to_end(key)
+        return cached[1]
+
+    task = _POINTS_INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.create_task(_fetch_points_data(key))
+        _POINTS_INFLIGHT[key] = task
+        task.add_done_callback(lambda _: _POINTS_INFLIGHT.pop(key, None))
+    # Shield so one cancelled caller doesn't cancel the request for the others
+    return await asyncio.shield(task)
+
+def clear_points_cache() -> None:
+    """Drop all cached gridpoint lookups."""
+    _POINTS_CACHE.clear()
+
 ##########################################################################
 
 ## T O O L S
@@ -55,15 +160,14 @@ async def get_forecast(latitude: float, longitude: float) -> str:
     as it uses the National Weather Service API.
     """
     # First get the forecast grid endpoint
-    points_url = f"{NWS_API_BASE}/points/{latitude},{longitude}"
-    points_data = make_nws_request(points_url)
+    points_data = await get_points_data(latitude, longitude)
 
     if not points_data:
         return "Unable to fetch forecast data for this location."
 
     # Get the forecast URL from the points response
     forecast_url = points_data["properties"]["forecast"]
-    forecast_data = make_nws_request(forecast_url)
+    forecast_data = await make_nws_request(forecast_url)
 
     if not forecast_data:
         return "Unable to fetch detailed forecast."
@@ -82,27 +186,17 @@ Forecast: {period['detailedForecast']}
 
     return "\n---\n".join(forecasts)
 
-@mcp.tool()
-async def get_current_weather(latitude: float, longitude: float) -> str:
-    """Get current weather conditions for a US location. Only supports US coordinates.
-
-    Args:
-        latitude: Latitude of the US location (e.g. 40.7128 for NYC)  
-        longitude: Longitude of the US location (e.g. -74.0060 for NYC)
-        
-    Note: This tool only works for coordinates within the United States
-    as it uses the National Weather Service API.
-    """
+async def fetch_current_weather(latitude: float, longitude: float) -> str:
+    """Fetch and format current weather conditions for one US location."""
     # Get the current conditions from the nearest station
-    points_url = f"{NWS_API_BASE}/points/{latitude},{longitude}"
-    points_data = make_nws_request(points_url)
+    points_data = await get_points_data(latitude, longitude)
 
     if not points_data:
         return "Unable to fetch weather data for this location."
 
     # Get observation stations
     stations_url = points_data["properties"]["observationStations"]
-    stations_data = make_nws_request(stations_url)
+    stations_data = await make_nws_request(stations_url)
 
     if not stations_data or not stations_data.get("features"):
         return "Unable to find nearby weather stations."
@@ -111,7 +205,7 @@ async def get_current_weather(latitude: float, longitude: float) -> str:
     station_id = stations_data["features"][0]["properties"]["stationIdentifier"]
     observations_url = f"{NWS_API_BASE}/stations/{station_id}/observations/latest"
     
-    observation_data = make_nws_request(observations_url)
+    observation_data = await make_nws_request(observations_url)
     
     if not observation_data:
         return "Unable to fetch current observations."
@@ -141,6 +235,45 @@ Wind Direction: {wind_direction}°
     
     return result.strip()
 
+@mcp.tool()
+async def get_current_weather(latitude: float, longitude: float) -> str:
+    """Get current weather conditions for a US location. Only supports US coordinates.
+
+    Args:
+        latitude: Latitude of the US location (e.g. 40.7128 for NYC)  
+        longitude: Longitude of the US location (e.g. -74.0060 for NYC)
+        
+    Note: This tool only works for coordinates within the United States
+    as it uses the National Weather Service API.
+    """
+    return await fetch_current_weather(latitude, longitude)
+
+# Upper bound on simultaneous NWS lookups from a single bulk call
+MAX_CONCURRENT_LOCATIONS = 4
+
+@mcp.tool()
+async def get_current_weather_for_locations(locations: list[tuple[float, float]]) -> str:
+    """Get current weather conditions for several US locations at once. Only supports US coordinates.
+
+    Args:
+        locations: List of (latitude, longitude) pairs, e.g. [[40.7128, -74.0060], [41.8781, -87.6298]]
+
+    Note: Locations are fetched concurrently, so this is much faster than calling
+    get_current_weather once per location.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_LOCATIONS)
+
+    async def fetch_one(latitude: float, longitude: float) -> str:
+        async with semaphore:
+            try:
+                report = await fetch_current_weather(latitude, longitude)
+            except Exception as e:
+                report = f"Unable to fetch weather data for this location: {str(e)}"
+        return f"Location: {latitude}, {longitude}\n{report}"
+
+    reports = await asyncio.gather(*(fetch_one(lat, lon) for lat, lon in locations))
+    return "\n---\n".join(reports)
+
 # Excercise 1
 # Create a tool that returns the current user's information
 
@@ -303,15 +436,14 @@ async def sampling_analyze_weather_trends(ctx: Context, latitude: float, longitu
     # Get extended forecast data
     #forecast_data = await fetch_nws_extended_forecast(latitude, longitude, days)
     # First get the forecast grid endpoint
-    points_url = f"{NWS_API_BASE}/points/{latitude},{longitude}"
-    points_data = make_nws_request(points_url)
+    points_data = await get_points_data(latitude, longitude)
 
     if not points_data:
         return "Unable to fetch forecast data for this location."
 
     # Get the forecast URL from the points response
     forecast_url = points_data["properties"]["forecast"]
-    forecast_data = make_nws_request(forecast_url)
+    forecast_data = await make_nws_request(forecast_url)
     
     prompt = f"""Analyze this {days}-day weather forecast and identify key patterns:
 
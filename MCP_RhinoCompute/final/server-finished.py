@@ -4,30 +4,54 @@ Provides tools to connect with Rhino.Compute
 """
 
 import os
-import requests
-import json
+import asyncio
+import logging
 from fastmcp import FastMCP, Context
 from pydantic import BaseModel, Field
-import rhino3dm
-import compute_rhino3d.Grasshopper as gh
-import compute_rhino3d.Util
 
-from helpers.helpers import add_parameter, decode_gh_output, save_3dm_file, create_file_path, resolve_path
+from helpers.helpers import COMPUTE_SESSION, describe_compute_error, json_loads, init_compute, add_parameter, add_parameters, format_parameters_batch, decode_gh_output, decode_gh_output_batch, save_3dm_file, create_file_path, resolve_path, run_rhino_compute, read_3dm_file
+
+log = logging.getLogger(__name__)
+
 # Create FastMCP server instance
 mcp = FastMCP("Simple MCP with Rhino.Compute")
 
-RHINO_COMPUTE_URL = "http://localhost:6500/"
-compute_rhino3d.Util.url = RHINO_COMPUTE_URL
-
-# compute_rhino3d.Util.apiKey = "..."
-# compute_rhino3d.Util.AuthToken = "..."
+RHINO_COMPUTE_URL = os.getenv("RHINO_COMPUTE_URL", "http://localhost:6500/").rstrip("/") + "/"
+init_compute(RHINO_COMPUTE_URL)
+
+# init_compute(RHINO_COMPUTE_URL, api_key="...", auth_token="...")
+
+# Grasshopper definitions shipped with the workshop, resolved once at startup
+ASSETS_DIR = os.path.abspath(os.getenv("GH_ASSETS_DIR", "assets"))
+WAVE_PATTERN_GH = os.path.join(ASSETS_DIR, "WavePatternFromSurface.gh")
+
+# Evaluate, decode and save are all blocking (network, native decoding, disk I/O),
+# so the tools run these whole pipelines through asyncio.to_thread
+def _run_and_save(pointer: str, gh_inputs: list, use_cache: bool = True) -> str:
+    """Run a Grasshopper definition, decode its output and save it to a new .3dm file."""
+    output = run_rhino_compute(pointer, gh_inputs, use_cache=use_cache)
+    decoded = decode_gh_output(output)
+    output_path = create_file_path(pointer)
+    save_3dm_file(decoded, output_path)
+    return output_path
+
+def _run_and_save_batch(pointer: str, input_sets: list[dict], use_cache: bool = True) -> list[str]:
+    """Run a Grasshopper definition for every input set and save one .3dm file per set."""
+    gh_inputs = format_parameters_batch(input_sets)
+    output = run_rhino_compute(pointer, gh_inputs, use_cache=use_cache)
+    output_files = []
+    for i, decoded in enumerate(decode_gh_output_batch(output, len(input_sets))):
+        output_path = create_file_path(pointer, suffix=f"_{i}")
+        save_3dm_file(decoded, output_path)
+        output_files.append(output_path)
+    return output_files
 
 ###############################################################
 ## T O O L S
 ###############################################################
 
 @mcp.tool
-def get_rhinocompute_version_details() -> dict:
+async def get_rhinocompute_version_details() -> dict:
     """
     Retrieves version information from the connected Rhino.Compute server.
 
@@ -48,20 +72,20 @@ def get_rhinocompute_version_details() -> dict:
     url = f"{RHINO_COMPUTE_URL}version"
 
     try:
-        response = requests.get(url, timeout=5)
+        response = await asyncio.to_thread(COMPUTE_SESSION.get, url, timeout=5)
         response_data = {
             "status": "success",
-            "version_info": response.json()
+            "version_info": json_loads(response.content)
         }
         return response_data
 
     except Exception as e:
-        response_data = {"error": f"Failed to contact Rhino.Compute: {str(e)}"}
+        response_data = {"error": f"Failed to contact Rhino.Compute: {describe_compute_error(e)}"}
         return response_data
 
 
 @mcp.tool
-def get_installed_rhino_plugins() -> dict:
+async def get_installed_rhino_plugins() -> dict:
     """
     Returns a list of Rhino plugins installed on the Rhino.Compute server.
 
@@ -81,21 +105,21 @@ def get_installed_rhino_plugins() -> dict:
     url = f"{RHINO_COMPUTE_URL}plugins/rhino/installed"
 
     try:
-        response = requests.get(url, timeout=5)
+        response = await asyncio.to_thread(COMPUTE_SESSION.get, url, timeout=5)
         response_data = {
             "status": "success",
-            "plugins": response.json()
+            "plugins": json_loads(response.content)
         }
         return response_data
 
     except Exception as e:
-        response_data = {"error": f"Failed to contact Rhino.Compute: {str(e)}"}
+        response_data = {"error": f"Failed to contact Rhino.Compute: {describe_compute_error(e)}"}
         return response_data
 
 ### EXERCISE 1 ### SOLVED
 # Add a new tool that checks which Grasshopper plugins are installed
 @mcp.tool
-def get_installed_grasshopper_plugins() -> dict:
+async def get_installed_grasshopper_plugins() -> dict:
     """
     Returns a list of Grasshopper plugins installed on the Rhino.Compute server.
 
@@ -115,21 +139,21 @@ def get_installed_grasshopper_plugins() -> dict:
     url = f"{RHINO_COMPUTE_URL}plugins/gh/installed"
 
     try:
-        response = requests.get(url, timeout=5)
+        response = await asyncio.to_thread(COMPUTE_SESSION.get, url, timeout=5)
         response_data = {
             "status": "success",
-            "plugins": response.json()
+            "plugins": json_loads(response.content)
         }
         return response_data
 
     except Exception as e:
-        response_data = {"error": f"Failed to contact Rhino.Compute: {str(e)}"}
+        response_data = {"error": f"Failed to contact Rhino.Compute: {describe_compute_error(e)}"}
         return response_data
     
 ##################
 
 @mcp.tool
-def read_grasshopper_inputs_outputs(pointer: str) -> dict:
+async def read_grasshopper_inputs_outputs(pointer: str) -> dict:
     """
     Reads the inputs and outputs of a Grasshopper definition using Rhino.Compute's /io endpoint.
 
@@ -157,8 +181,8 @@ def read_grasshopper_inputs_outputs(pointer: str) -> dict:
     payload = {"algo": None, "pointer": pointer}
 
     try:
-        response = requests.post(f"{RHINO_COMPUTE_URL}io", json=payload, timeout=10)
-        data = response.json()
+        response = await asyncio.to_thread(COMPUTE_SESSION.post, f"{RHINO_COMPUTE_URL}io", json=payload, timeout=10)
+        data = json_loads(response.content)
 
         response_data = {
             "status": "success",
@@ -171,17 +195,19 @@ def read_grasshopper_inputs_outputs(pointer: str) -> dict:
         return response_data
 
     except Exception as e:
-        response_data = {"error": f"Failed to contact Rhino.Compute: {str(e)}"}
+        response_data = {"error": f"Failed to contact Rhino.Compute: {describe_compute_error(e)}"}
         return response_data
 
 @mcp.tool
-def run_grasshopper_tool(pointer: str, inputs: dict) -> dict:
+async def run_grasshopper_tool(pointer: str, inputs: dict, use_cache: bool = True) -> dict:
     """
     Runs a generic Grasshopper definition via Rhino.Compute using compute_rhino3dm.
 
     Args:
         pointer: Absolute path to the .gh or .ghx definition file.
         inputs: Dictionary of input names and their values.
+        use_cache: Reuse the result of an identical run from the last few minutes.
+                   Set to False for definitions that are random or read files or web data.
 
     """
     
@@ -190,32 +216,66 @@ def run_grasshopper_tool(pointer: str, inputs: dict) -> dict:
         return {"error": f"Grasshopper file not found: '{pointer}'"}
 
     try:
-        # Prepare the inputs for Grasshopper
-        gh_inputs = []
-        for name, value in inputs.items():
-            # Convert each input to the format Grasshopper expects
-            param = add_parameter(name, value)
-            gh_inputs.append(param)
+        # Convert each input to the format Grasshopper expects
+        gh_inputs = add_parameters(inputs)
 
-        # Evaluate
-        output = gh.EvaluateDefinition(pointer, gh_inputs)
+        # Evaluate, decode and save the result off the event loop
+        output_path = await asyncio.to_thread(_run_and_save, pointer, gh_inputs, use_cache)
 
-        # Decode
-        decoded = decode_gh_output(output)
+        response_data = {
+            "status": "success",
+            "pointer": pointer,
+            "output_file": output_path
+        }
+        return response_data
 
-        # Save result
-        output_path = create_file_path(pointer)
-        save_3dm_file(decoded, output_path)
+    except Exception as e:
+        response_data = {"error": f"Failed to run Grasshopper definition: {describe_compute_error(e)}"}
+        return response_data
+
+@mcp.tool
+async def run_grasshopper_batch(pointer: str, input_sets: list[dict], use_cache: bool = True) -> dict:
+    """
+    Runs a Grasshopper definition for several sets of inputs in a single Rhino.Compute call.
+
+    Use this instead of calling run_grasshopper_tool repeatedly when you need
+    the same definition evaluated for many input combinations. Each input set
+    is sent as its own data tree branch, so the definition must not flatten or graft
+    its inputs; if the {0;i} output branches don't come back, an error is returned.
+
+    Args:
+        pointer: Absolute path to the .gh or .ghx definition file.
+        input_sets: List of dictionaries of input names and their values, one per run.
+                    Every set must provide the same input names.
+        use_cache: Reuse the result of an identical batch from the last few minutes.
+                   Set to False for definitions that are random or read files or web data.
+
+    Returns:
+        dict: {
+            "status": "success",
+            "pointer": pointer,
+            "output_files": [...]
+        }
+        or {"error": "..."}
+    """
+    pointer = resolve_path(pointer)
+    if not os.path.exists(pointer):
+        return {"error": f"Grasshopper file not found: '{pointer}'"}
+
+    try:
+        # Pack every input set into one request, one {0;i} branch per set,
+        # then evaluate and save one file per set off the event loop
+        output_files = await asyncio.to_thread(_run_and_save_batch, pointer, input_sets, use_cache)
 
         response_data = {
             "status": "success",
             "pointer": pointer,
-            "output_file": output_path
+            "output_files": output_files
         }
         return response_data
 
     except Exception as e:
-        response_data = {"error": f"Failed to run Grasshopper definition: {str(e)}"}
+        response_data = {"error": f"Failed to run Grasshopper batch: {describe_compute_error(e)}"}
         return response_data
 
 ### EXERCISE 2 ###
@@ -225,7 +285,7 @@ def run_grasshopper_tool(pointer: str, inputs: dict) -> dict:
 ##################
 
 @mcp.tool
-def run_wave_pattern_from_surface(path: str) -> dict:
+async def run_wave_pattern_from_surface(path: str) -> dict:
     """
     Generates a wave pattern on a surface stored inside a Rhino .3dm file
     by evaluating the Grasshopper definition 'WavePatternFromSurface.gh'
@@ -254,43 +314,45 @@ def run_wave_pattern_from_surface(path: str) -> dict:
             return {"error": f"Rhino file not found: '{path}'"}
 
         # Resolve GH definition path
-        gh_path = os.path.abspath(
-            os.path.join("assets", "WavePatternFromSurface.gh")
-        )
+        gh_path = WAVE_PATTERN_GH
         if not os.path.exists(gh_path):
             return {"error": f"Grasshopper file not found at '{gh_path}'"}
 
         # Load Rhino model
-        model = rhino3dm.File3dm.Read(path)
+        model = await asyncio.to_thread(read_3dm_file, path)
         if model is None or not model.Objects:
             return {"error": f"Could not read geometry from '{path}'"}
         
-        print(f"Running Grasshopper definition '{gh_path}' with surface from '{path}'")
+        log.info("Running Grasshopper definition '%s' with surface from '%s'", gh_path, path)
             
         # Extract first geometry
         geometry = model.Objects[0].Geometry
 
-        # Encode geometry and convert to JSON
-        encoded_geo = json.dumps(geometry.Encode())
-
         # Used add_parameter method to create GH input called "surface"
-        surface_parameter = add_parameter("surface", encoded_geo)
+        # (add_parameter encodes Rhino geometry to JSON for you)
+        surface_parameter = add_parameter("surface", geometry)
 
         # Add this parameter to the list of GH inputs called gh_inputs
         gh_inputs = [surface_parameter]
 
         # Run Grasshopper definition through Rhino.Compute using gh_path and gh_inputs
         # and save the result to variable called output
-        output = gh.EvaluateDefinition(gh_path, gh_inputs)
+        # (run it with asyncio.to_thread so the server keeps serving other requests)
+        output = await asyncio.to_thread(run_rhino_compute, gh_path, gh_inputs)
 
         # Decode Compute output into variable called decoded
-        decoded = decode_gh_output(output)
+        # (decoding is blocking too, so also run it with asyncio.to_thread)
+        decoded = await asyncio.to_thread(decode_gh_output, output)
 
         # Create a file path to save the result .3dm file
         output_file = create_file_path(gh_path)
 
         # Save the decoded result into the output_file using save_3dm_file method
-        save_3dm_file(decoded, output_file)
+        # (writing the file is blocking disk I/O, run it with asyncio.to_thread as well)
+        await asyncio.to_thread(save_3dm_file, decoded, output_file)
+
+        # Shortcut: _run_and_save(gh_path, gh_inputs) does the four steps above in one worker
+        # thread and returns the output file path
 
         # Add to the response data the pointer to GH file and output file path
         response_data = {
@@ -301,7 +363,7 @@ def run_wave_pattern_from_surface(path: str) -> dict:
         return response_data
 
     except Exception as e:
-        response_data = {"error": f"Failed to run wave pattern tool: {str(e)}"}
+        response_data = {"error": f"Failed to run wave pattern tool: {describe_compute_error(e)}"}
         return response_data
 
 
@@ -310,6 +372,10 @@ def run_wave_pattern_from_surface(path: str) -> dict:
 ##############################################################
 
 if __name__ == "__main__":
+    # Send tool and helper logs to stderr, keeping stdout free for the MCP protocol;
+    # use logging.DEBUG to also see each decoded Grasshopper output
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+
     # Run the MCP server with HTTP transport (Streamable HTTP)
     mcp.run(
         transport="http",
@@ -1,119 +1,422 @@
 import os
+import base64
 import datetime
+import hashlib
 import json
+import logging
+import threading
+import time
+import uuid
+import requests
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import compute_rhino3d.Grasshopper as gh
+import compute_rhino3d.Util
 import rhino3dm
-from typing import Any, List, Dict
+from typing import Any, List, Dict, Optional, Tuple
 
+# orjson is much faster on large Grasshopper payloads; fall back to the stdlib when missing
+try:
+    import orjson
 
-def create_file_path(pointer: str) -> str:
+    def json_loads(data: Any) -> Any:
+        return orjson.loads(data)
+
+    def json_dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+
+    def json_dumpb(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:
+    json_loads = json.loads
+    json_dumps = json.dumps
+
+    def json_dumpb(obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+log = logging.getLogger(__name__)
+
+# Output .3dm files go to MCP_RhinoCompute/outputs (one folder up from helpers/) unless overridden
+OUTPUT_DIR = os.path.abspath(os.getenv(
+    "GH_OUTPUT_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "outputs")
+))
+
+COMPUTE_HEADERS = {"Content-Type": "application/json"}
+# (connect, read) in seconds: fail fast when Compute is down, but allow slow Grasshopper solves
+COMPUTE_TIMEOUT = (3.05, 300)
+
+def create_session(headers: Optional[Dict[str, str]] = None) -> requests.Session:
+    """Create a requests.Session with a pooled, retrying HTTP adapter.
+
+    Failed connections are retried for every method. Read errors and 502/503/504
+    answers (with jitter and Retry-After) are only retried for idempotent methods
+    such as GET, so /grasshopper and /io POSTs get connect retries only and a
+    solve that may already have run is never sent twice.
+    """
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=0.2, backoff_jitter=0.1,
+                    status_forcelist=[502, 503, 504], respect_retry_after_header=True,
+                    allowed_methods=Retry.DEFAULT_ALLOWED_METHODS)
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+# Shared session so keep-alive connections to Rhino.Compute are reused across calls;
+# run_rhino_compute uses it by default and the servers use it for every other request
+COMPUTE_SESSION = create_session()
+
+
+def create_file_path(pointer: str, suffix: str = "") -> str:
     """Create a unique file path for saving output files."""
 
-    # Make filename unique: extract base name and add timestamp
+    # Make filename unique: extract base name and add timestamp, plus a random tag
+    # so runs finishing within the same second don't overwrite each other
     base_name = os.path.splitext(os.path.basename(pointer))[0]
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    # Go one folder up from the current file's directory
-    parent_dir = os.path.dirname(os.path.dirname(__file__))
-    output_dir = os.path.join(parent_dir, "outputs")
-    os.makedirs(output_dir, exist_ok=True)  # Ensure outputs directory exists
-    filename = f"{base_name}_{timestamp}.3dm"
-    output_path = os.path.join(output_dir, filename)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)  # Ensure outputs directory exists
+    filename = f"{base_name}{suffix}_{timestamp}_{uuid.uuid4().hex[:8]}.3dm"
+    output_path = os.path.join(OUTPUT_DIR, filename)
     return output_path
 
+def init_compute(url: str, api_key: str = "", auth_token: str = "") -> None:
+    """Point compute_rhino3d and the shared COMPUTE_SESSION at a Rhino.Compute server."""
+    compute_rhino3d.Util.url = url if url.endswith("/") else url + "/"
+    compute_rhino3d.Util.apiKey = api_key
+    compute_rhino3d.Util.authToken = auth_token
+
+    # Credentials live on the session, so every request made through it is authenticated
+    headers = COMPUTE_SESSION.headers
+    headers.pop("Authorization", None)
+    headers.pop("RhinoComputeKey", None)
+    if auth_token:
+        headers["Authorization"] = "Bearer " + auth_token
+    if api_key:
+        headers["RhinoComputeKey"] = api_key
+
+# Exact Python type -> .NET type name; exact lookup keeps bool from matching int
+_TYPE_MAP = {
+    str: "System.String",
+    bool: "System.Boolean",
+    int: "System.Int32",
+    float: "System.Double",
+}
+
+def format_parameter(value: Any) -> Dict[str, Any]:
+    """Format a single input value as a Rhino.Compute data tree item."""
+    value_type = type(value)
+    net_type = _TYPE_MAP.get(value_type)
+    if net_type is None:
+        if hasattr(value, "Encode"):
+            # Rhino geometry is encoded exactly once, straight into the item
+            return {"type": f"Rhino.Geometry.{value_type.__name__}", "data": encode_geometry(value)}
+        if isinstance(value, (dict, list)):
+            # Compute expects the data field as a JSON string, e.g. an already encoded geometry dict
+            return {"data": json_dumps(value)}
+        return {"data": value}
+    if value_type is str:
+        data = value
+    elif value_type is bool:
+        data = "true" if value else "false"
+    elif value_type is float and value.is_integer():
+        # Send 3.0 as "3" so it also parses into Grasshopper integer inputs
+        data = "%d" % value
+    else:
+        data = str(value)
+    return {"type": net_type, "data": data}
+
 def add_parameter(input_name: str, input_value: Any) -> gh.DataTree:
     input_tree = gh.DataTree(input_name)
-    input_tree.Append([0], [input_value])
+    input_tree.data['InnerTree']['0'] = [format_parameter(input_value)]
     return input_tree
 
+def add_parameters(inputs: Dict[str, Any]) -> List[gh.DataTree]:
+    """Build the Grasshopper input trees for a dictionary of input names and values."""
+    return [add_parameter(name, value) for name, value in inputs.items()]
+
+def encode_geometry(geometry: rhino3dm.CommonObject) -> str:
+    """Encode Rhino geometry to the JSON string Rhino.Compute expects as input data."""
+    return json_dumps(geometry.Encode())
+
+def format_parameters_batch(param_dicts: List[Dict[str, Any]]) -> List[gh.DataTree]:
+    """Pack several parameter sets into one DataTree per input, one {0;i} branch per set.
+
+    Lets a single Grasshopper evaluation process every set, as long as the
+    definition keeps the branch structure intact (no flatten on the inputs).
+    Every set must provide the same inputs, otherwise Grasshopper would silently
+    match a missing branch against another set's value.
+    """
+    if not param_dicts:
+        raise ValueError("At least one parameter set is required")
+    names = param_dicts[0].keys()
+    for i, params in enumerate(param_dicts):
+        if params.keys() != names:
+            raise ValueError(
+                f"Parameter set {i} has inputs {sorted(params)}, expected {sorted(names)} like set 0"
+            )
+
+    trees: Dict[str, gh.DataTree] = {}
+    for i, params in enumerate(param_dicts):
+        for name, value in params.items():
+            tree = trees.get(name)
+            if tree is None:
+                tree = trees[name] = gh.DataTree(name)
+            tree.data['InnerTree'][f'0;{i}'] = [format_parameter(value)]
+    return list(trees.values())
+
+# First character of an output item decides how it is decoded
+_GEOMETRY_PREFIX = frozenset('{[')
+_NUMBER_PREFIX = frozenset('-0123456789.')
+
 def decode_gh_output(output: dict, tree_path: str = '{0}') -> List[Any]:
     """Decode Grasshopper output at a given tree path into Rhino geometry, numbers, or text."""
     branch = output['values'][0]['InnerTree'][tree_path]
-    results = []
-    for item in branch:
+    results = [None] * len(branch)
+    for i, item in enumerate(branch):
         data = item['data']
+        if not isinstance(data, str):
+            results[i] = data
+            continue
         # Remove extra quotes if present (e.g., '"10"' -> '10')
-        if isinstance(data, str) and data.startswith('"') and data.endswith('"'):
+        if data[:1] == '"' and data[-1:] == '"':
             data = data[1:-1]
-        # Try geometry decode
-        try:
-            obj = rhino3dm.CommonObject.Decode(json.loads(data))
-            print('decoded object:')
-            print(obj)
-            if obj is not None:
-                results.append(obj)
-                continue
-        except Exception:
-            pass
-        # Try number decode
-        try:
-            if '.' in data:
-                num = float(data)
-            else:
-                num = int(data)
-            results.append(num)
-            continue
-        except Exception:
-            pass
-        # Fallback: return as string
-        results.append(data)
+        first = data[:1]
+        if first in _GEOMETRY_PREFIX:
+            # Geometry decode, falling back to the raw string
+            try:
+                obj = rhino3dm.CommonObject.Decode(json_loads(data))
+            except Exception:
+                obj = None
+            log.debug("Decoded object: %s", obj)
+            results[i] = obj if obj is not None else data
+        elif first in _NUMBER_PREFIX:
+            # Number decode, falling back to the raw string
+            try:
+                is_float = '.' in data or 'e' in data or 'E' in data
+                results[i] = float(data) if is_float else int(data)
+            except ValueError:
+                results[i] = data
+        else:
+            results[i] = data
     return results
 
+def decode_gh_output_batch(output: dict, count: int) -> List[List[Any]]:
+    """Decode the {0;i} branches of a batched evaluation, one result list per parameter set.
+
+    Raises ValueError when any branch is missing, e.g. because the definition
+    flattened or grafted its inputs and the results no longer map to the sets.
+    """
+    inner_tree = output['values'][0]['InnerTree']
+    tree_paths = [f'{{0;{i}}}' for i in range(count)]
+    missing = [tree_path for tree_path in tree_paths if tree_path not in inner_tree]
+    if missing:
+        raise ValueError(
+            f"Batch output is missing branches {', '.join(missing)} "
+            f"(found {', '.join(sorted(inner_tree)) or 'none'}); "
+            "the definition must keep the {0;i} structure of its inputs"
+        )
+    return [decode_gh_output(output, tree_path) for tree_path in tree_paths]
+
+# Geometry type -> File3dmObjectTable method used to add it, checked in order
+_ADDERS = [
+    (rhino3dm.Curve, "AddCurve"),
+    (rhino3dm.Point, "Add"),
+    (rhino3dm.Surface, "AddSurface"),
+    (rhino3dm.Mesh, "AddMesh"),
+    (rhino3dm.Brep, "AddBrep"),
+]
+if hasattr(rhino3dm, "SubD"):
+    _ADDERS.append((rhino3dm.SubD, "Add"))
+
 def save_3dm_file(objects: List[rhino3dm.CommonObject], filename: str) -> None:
 
     """Save a list of Rhino geometry objects to a .3dm file, handling multiple types."""
     model = rhino3dm.File3dm()
+    model_objects = model.Objects
+    # Resolve the add method once per concrete type; outputs are usually homogeneous
+    adders = {}
     for obj in objects:
-        # Try adding as curve
-        try:
-            if isinstance(obj, rhino3dm.Curve):
-                model.Objects.AddCurve(obj)
-                continue
-        except Exception:
-            pass
-        # Try adding as point
-        try:
-            if isinstance(obj, rhino3dm.Point):
-                model.Objects.AddPoint(obj)
-                continue
-        except Exception:
-            pass
-        # Try adding as surface
-        try:
-            if isinstance(obj, rhino3dm.Surface):
-                model.Objects.AddSurface(obj)
-                continue
-        except Exception:
-            pass
-        # Try adding as mesh
-        try:
-            if isinstance(obj, rhino3dm.Mesh):
-                model.Objects.AddMesh(obj)
-                continue
-        except Exception:
-            pass
-        # Try adding as bpre
-        try:
-            if isinstance(obj, rhino3dm.Brep):
-                model.Objects.AddBrep(obj)
-                continue
-        except Exception:
-            pass
-        # Try subs
-        try:
-            if isinstance(obj, rhino3dm.SubD):
-                model.Objects.Add(obj)
-                continue
-        except Exception:
-            pass
-        # Try adding as SubD
-        try:
-            if hasattr(rhino3dm, "SubD") and isinstance(obj, rhino3dm.SubD):
-                model.Objects.AddSubD(obj)
-                continue
-        except Exception:
-            pass
-        # Add more geometry types as needed
-    model.Write(filename)
+        obj_type = type(obj)
+        if obj_type not in adders:
+            adders[obj_type] = next(
+                (getattr(model_objects, method) for cls, method in _ADDERS if isinstance(obj, cls)),
+                None
+            )
+        adder = adders[obj_type]
+        if adder is not None:
+            adder(obj)
+        # Unsupported types (numbers, text, ...) are skipped
+    if not model.Write(filename):
+        raise IOError(f"Failed to write 3dm file: '{filename}'")
+
+# Recent Grasshopper results keyed by a hash of the request, so identical runs skip Compute
+RESULT_CACHE_SIZE = 32
+RESULT_CACHE_TTL = 600  # seconds
+_RESULT_CACHE: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+_RESULT_CACHE_LOCK = threading.Lock()
+
+# Server-side cache pointers for definitions already uploaded, keyed by (path, mtime, size)
+_DEFINITION_POINTERS: Dict[Tuple[str, int, int], str] = {}
+# Rhino.Compute answers an unknown cache pointer with an error carrying this message
+_UNKNOWN_POINTER_MESSAGE = "unable to load grasshopper definition"
+
+def _is_unknown_pointer(e: requests.HTTPError) -> bool:
+    """Tell a dropped cache pointer apart from solve failures and gateway errors."""
+    response = e.response
+    if response is None or response.status_code in (502, 503, 504):
+        return False
+    return response.status_code == 404 or _UNKNOWN_POINTER_MESSAGE in response.text.lower()
+
+def clear_result_cache() -> None:
+    """Drop all cached Grasshopper results."""
+    with _RESULT_CACHE_LOCK:
+        _RESULT_CACHE.clear()
+
+@lru_cache(maxsize=32)
+def _encode_definition(definition_path: str, mtime_ns: int, size: int) -> str:
+    """Read a .gh/.ghx file and base64 encode it for the 'algo' field.
+
+    mtime_ns and size are only part of the cache key, so an edited file is read again.
+    """
+    with open(definition_path, "rb") as f:
+        content = f.read()
+    if not definition_path.endswith("gh"):
+        # .ghx files are XML, strip a possible BOM before encoding
+        content = content.decode("utf-8-sig").encode("utf-8")
+    return base64.b64encode(content).decode("ascii")
+
+def _post_grasshopper(session: requests.Session, url: str, algo: Optional[str],
+                      pointer: Optional[str], values_json: bytes) -> dict:
+    """POST one evaluation to Rhino.Compute and parse the JSON response."""
+    # Only algo and pointer change between attempts, the serialized values are reused
+    body = b'{"algo":%b,"pointer":%b,"values":%b}' % (json_dumpb(algo), json_dumpb(pointer), values_json)
+    response = session.post(url, data=body, headers=COMPUTE_HEADERS, timeout=COMPUTE_TIMEOUT)
+    response.raise_for_status()
+    # Parse the raw bytes directly, skipping the decoded str copy of response.text
+    return json_loads(response.content)
+
+def run_rhino_compute(definition_path: str, trees: List[gh.DataTree],
+                      session: Optional[requests.Session] = None,
+                      use_cache: bool = True) -> dict:
+    """Evaluate a Grasshopper definition on Rhino.Compute over a pooled HTTP session.
+
+    Drop-in replacement for gh.EvaluateDefinition that reuses connections
+    between calls instead of opening a new one for every evaluation.
+    A local definition is uploaded once; later calls send the cache pointer
+    Rhino.Compute returned, and re-upload only if the server has dropped it.
+    Identical requests within RESULT_CACHE_TTL are answered from memory;
+    pass use_cache=False for definitions with side effects or randomness.
+    The returned dict may be shared and should be treated as read-only.
+    """
+    session = session or COMPUTE_SESSION
+    url = f"{compute_rhino3d.Util.url}grasshopper"
+    values_json = json_dumpb([tree.data for tree in trees])
+
+    if definition_path.startswith(("http:", "https:")):
+        definition_key = None
+        definition_id = definition_path
+    else:
+        st = os.stat(definition_path)
+        definition_key = (definition_path, st.st_mtime_ns, st.st_size)
+        definition_id = "%s|%d|%d" % definition_key
+
+    if use_cache:
+        # Definition identity plus every input fully identifies the run
+        key = hashlib.sha1(f"{url}|{definition_id}|".encode("utf-8") + values_json).hexdigest()
+        with _RESULT_CACHE_LOCK:
+            cached = _RESULT_CACHE.get(key)
+            if cached is not None and time.monotonic() - cached[0] < RESULT_CACHE_TTL:
+                _RESULT_CACHE.move_to_end(key)
+                return cached[1]
+
+    output = None
+    if definition_key is None:
+        output = _post_grasshopper(session, url, None, definition_path, values_json)
+    else:
+        server_pointer = _DEFINITION_POINTERS.get(definition_key)
+        if server_pointer is not None:
+            try:
+                output = _post_grasshopper(session, url, None, server_pointer, values_json)
+            except requests.HTTPError as e:
+                # Only re-upload when Compute no longer holds the definition (e.g. it restarted);
+                # real solve failures and gateway errors keep the pointer and are raised
+                if not _is_unknown_pointer(e):
+                    raise
+                _DEFINITION_POINTERS.pop(definition_key, None)
+        if output is None:
+            output = _post_grasshopper(session, url, _encode_definition(*definition_key), None, values_json)
+            if output.get("pointer"):
+                _DEFINITION_POINTERS[definition_key] = output["pointer"]
+
+    if use_cache:
+        with _RESULT_CACHE_LOCK:
+            _RESULT_CACHE[key] = (time.monotonic(), output)
+            _RESULT_CACHE.move_to_end(key)
+            if len(_RESULT_CACHE) > RESULT_CACHE_SIZE:
+                _RESULT_CACHE.popitem(last=False)
+    return output
+
+def run_rhino_compute_concurrent(jobs: List[Tuple[str, List[gh.DataTree]]],
+                                 max_workers: int = 8,
+                                 session: Optional[requests.Session] = None) -> List[dict]:
+    """Evaluate several (definition_path, trees) jobs in parallel on the shared session.
+
+    Use this when a definition can't take batched {0;i} inputs; results keep the job order.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_rhino_compute, path, trees, session) for path, trees in jobs]
+        return [future.result() for future in futures]
+
+# Parsed models keyed by (path, mtime, size) so an edited file is re-read
+MODEL_CACHE_SIZE = 32
+_MODEL_CACHE: "OrderedDict[Tuple[str, int, int], rhino3dm.File3dm]" = OrderedDict()
+_MODEL_CACHE_LOCK = threading.Lock()
+
+def read_3dm_file(path: str) -> Optional[rhino3dm.File3dm]:
+    """Read a .3dm file, reusing the parsed model while the file is unchanged.
+
+    The returned model is shared between callers and should be treated as read-only.
+    """
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    with _MODEL_CACHE_LOCK:
+        model = _MODEL_CACHE.get(key)
+        if model is not None:
+            _MODEL_CACHE.move_to_end(key)
+            return model
+
+    model = rhino3dm.File3dm.Read(path)
+    if model is not None:
+        with _MODEL_CACHE_LOCK:
+            _MODEL_CACHE[key] = model
+            if len(_MODEL_CACHE) > MODEL_CACHE_SIZE:
+                _MODEL_CACHE.popitem(last=False)
+    return model
+
+def invalidate_model_cache(path: Optional[str] = None) -> None:
+    """Drop cached models for one path, or all of them."""
+    with _MODEL_CACHE_LOCK:
+        if path is None:
+            _MODEL_CACHE.clear()
+            return
+        for key in [key for key in _MODEL_CACHE if key[0] == path]:
+            del _MODEL_CACHE[key]
+
+def describe_compute_error(e: Exception) -> str:
+    """Turn a Rhino.Compute request failure into an actionable error message."""
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return f"Timed out connecting to Rhino.Compute at {compute_rhino3d.Util.url}, check that it is running and reachable"
+    if isinstance(e, requests.exceptions.ReadTimeout):
+        return "Rhino.Compute accepted the request but did not answer in time, the definition may be too slow or stuck"
+    if isinstance(e, requests.exceptions.ConnectionError):
+        return f"Could not connect to Rhino.Compute at {compute_rhino3d.Util.url}, make sure it is running"
+    return str(e)
 
 def resolve_path(path: str) -> str:
     """Resolves a path to absolute if it's not already."""
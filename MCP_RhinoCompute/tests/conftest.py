@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Import helpers the same way the servers do, from the MCP_RhinoCompute folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
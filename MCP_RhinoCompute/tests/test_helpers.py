@@ -0,0 +1,25 @@
+import rhino3dm
+
+from helpers.helpers import create_file_path, decode_gh_output, encode_geometry, save_3dm_file
+
+
+def test_save_3dm_file_mixed_point_and_curve(tmp_path):
+    point = rhino3dm.Point(rhino3dm.Point3d(1, 2, 3))
+    curve = rhino3dm.LineCurve(rhino3dm.Point3d(0, 0, 0), rhino3dm.Point3d(1, 0, 0))
+    output = {"values": [{"InnerTree": {"{0}": [
+        {"data": encode_geometry(point)},
+        {"data": encode_geometry(curve)},
+    ]}}]}
+    decoded = decode_gh_output(output)
+
+    path = str(tmp_path / "mixed.3dm")
+    save_3dm_file(decoded, path)
+
+    model = rhino3dm.File3dm.Read(path)
+    saved = sorted(type(obj.Geometry).__name__ for obj in model.Objects)
+    assert saved == ["LineCurve", "Point"]
+
+
+def test_create_file_path_is_unique_within_a_second():
+    paths = {create_file_path("definition.gh", suffix="_0") for _ in range(100)}
+    assert len(paths) == 100